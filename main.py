@@ -1,37 +1,188 @@
 import streamlit as st
 import sqlite3
-import qrcode
-import cv2
 import numpy as np
 from PIL import Image
 import io
+import csv
 import uuid
 import json
 from datetime import datetime, timedelta
 import math
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import base64
 import os
 import hashlib
+import hmac
+import struct
+import binascii
+import threading
+import queue
+from concurrent.futures import Future
+
+# cv2, qrcode and plotly are imported inside the functions that use them,
+# so pages that never scan, generate or chart don't pay their import cost
 
 # Database configuration - PERSISTENT DATABASE
 DB_PATH = 'smart_attendance_system.db'
 
-def get_db_connection():
-    """Get database connection with proper setup"""
-    conn = sqlite3.connect(DB_PATH)
+# Hot-path SQL, kept verbatim so the connection's statement cache is hit
+SQL_LOGIN = "SELECT faculty_id, name, role, department, password_hash, is_active FROM faculty WHERE faculty_id = ?"
+SQL_UPDATE_LOGIN = "UPDATE faculty SET last_login = ? WHERE faculty_id = ?"
+SQL_UPDATE_PASSWORD = "UPDATE faculty SET password_hash = ? WHERE faculty_id = ?"
+SQL_QR_LOOKUP = "SELECT 1 FROM qr_codes WHERE qr_id = ? AND is_active = 1"
+SQL_INSERT_ATTENDANCE = '''
+    INSERT OR IGNORE INTO attendance (
+        student_name, student_roll, subject, period, timestamp, device_id,
+        student_latitude, student_longitude, qr_latitude, qr_longitude, 
+        status, marked_by, created_date
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    RETURNING id
+'''
+
+# Password hashing - scrypt with a per-password random salt
+PASSWORD_SCHEME = 'scrypt$'
+SCRYPT_PARAMS = {'n': 16384, 'r': 8, 'p': 1, 'dklen': 32}
+SALT_BYTES = 16
+
+# GPS distance constants
+EARTH_RADIUS_M = 6371000.0
+EARTH_DIAMETER_M = 2 * EARTH_RADIUS_M
+DEG_TO_RAD = math.pi / 180.0
+
+# QR payload - packed binary (uuid, created/expires epoch, lat, lon) + "subject|period"
+QR_PAYLOAD_FORMAT = '<16sIIdd'
+QR_PAYLOAD_HEADER_SIZE = struct.calcsize(QR_PAYLOAD_FORMAT)
+QR_SCAN_MAX_SIDE = 1024  # uploads are downscaled to this before detection
+
+# Attendance writes - rows queued while a commit is in flight share the next one
+ATTENDANCE_BATCH_SIZE = 50
+ATTENDANCE_WRITE_TIMEOUT = 30  # seconds
+
+# Attendance records page size for the keyset-paginated records view
+ATTENDANCE_PAGE_SIZE = 50
+CSV_EXPORT_CHUNK_ROWS = 1000
+
+# Custom CSS injected at the top of every page
+APP_CSS = """
+<style>
+.main > div {
+    padding-top: 2rem;
+}
+.stButton > button {
+    border-radius: 10px;
+    border: none;
+    font-weight: bold;
+    transition: all 0.3s;
+}
+.stButton > button[kind="primary"] {
+    background: linear-gradient(45deg, #667eea 0%, #764ba2 100%);
+    color: white;
+}
+.stButton > button[kind="primary"]:hover {
+    background: linear-gradient(45deg, #764ba2 0%, #667eea 100%);
+    transform: translateY(-2px);
+}
+.stButton > button[kind="secondary"] {
+    background: linear-gradient(45deg, #ffeaa7 0%, #fab1a0 100%);
+    color: #2d3436;
+}
+.stMetric {
+    background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
+    padding: 1rem;
+    border-radius: 10px;
+    color: white;
+}
+</style>
+"""
+
+def open_db_connection():
+    """Open a new database connection with proper setup"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA wal_autocheckpoint = 1000")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA mmap_size = 268435456")
     return conn
 
+@st.cache_resource
+def get_db_connection():
+    """Get the shared database connection, created once per process"""
+    return open_db_connection()
+
+def fetch_dataframe(query, params=()):
+    """Run a query on the shared connection and wrap the rows in a DataFrame"""
+    cursor = get_db_connection().execute(query, params)
+    return pd.DataFrame(cursor.fetchall(), columns=[col[0] for col in cursor.description])
+
+def export_csv(query, params=()):
+    """Write query results to CSV in fetchmany chunks, without building a DataFrame"""
+    cursor = get_db_connection().execute(query, params)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow([col[0] for col in cursor.description])
+    while True:
+        rows = cursor.fetchmany(CSV_EXPORT_CHUNK_ROWS)
+        if not rows:
+            break
+        writer.writerows(rows)
+    return buffer.getvalue()
+
+def _attendance_writer(pending):
+    """Commit queued attendance rows in batches on a dedicated connection"""
+    conn = open_db_connection()
+    while True:
+        batch = [pending.get()]
+        while len(batch) < ATTENDANCE_BATCH_SIZE:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Duplicates are skipped by idx_att_unique; RETURNING tells each caller whether its row went in
+            inserted_ids = [conn.execute(SQL_INSERT_ATTENDANCE, row).fetchone() for row, _ in batch]
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, done in batch:
+                done.set_exception(e)
+        else:
+            for (_, done), inserted in zip(batch, inserted_ids):
+                done.set_result(inserted[0] if inserted else None)
+
+@st.cache_resource
+def get_attendance_queue():
+    """Get the attendance write queue, starting its writer thread once per process"""
+    pending = queue.Queue()
+    threading.Thread(target=_attendance_writer, args=(pending,), daemon=True).start()
+    return pending
+
+def save_attendance(row):
+    """Queue an attendance row and wait until its batch is committed.
+    
+    Returns the new row id, or None if the student was already marked for that class today.
+    """
+    done = Future()
+    get_attendance_queue().put((row, done))
+    return done.result(timeout=ATTENDANCE_WRITE_TIMEOUT)
+
+@st.cache_resource
 def init_database():
-    """Initialize database with all required tables"""
+    """Initialize database with all required tables (runs once per process)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Create attendance table
-    cursor.execute('''
+    # Create all tables in a single transaction
+    conn.executescript('''
+        BEGIN;
+        
+        -- Create attendance table
         CREATE TABLE IF NOT EXISTS attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_name TEXT NOT NULL,
@@ -49,11 +200,9 @@ def init_database():
             modified_by TEXT,
             modification_reason TEXT,
             created_date DATE DEFAULT (DATE('now'))
-        )
-    ''')
-    
-    # Create QR codes table
-    cursor.execute('''
+        );
+        
+        -- Create QR codes table
         CREATE TABLE IF NOT EXISTS qr_codes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             qr_id TEXT UNIQUE NOT NULL,
@@ -64,12 +213,11 @@ def init_database():
             created_at DATETIME NOT NULL,
             expires_at DATETIME NOT NULL,
             created_by TEXT,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Create faculty table
-    cursor.execute('''
+            is_active BOOLEAN DEFAULT 1,
+            created_day DATE GENERATED ALWAYS AS (DATE(created_at)) VIRTUAL
+        );
+        
+        -- Create faculty table
         CREATE TABLE IF NOT EXISTS faculty (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             faculty_id TEXT UNIQUE NOT NULL,
@@ -82,11 +230,9 @@ def init_database():
             is_active BOOLEAN DEFAULT 1,
             last_login DATETIME,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create students table
-    cursor.execute('''
+        );
+        
+        -- Create students table
         CREATE TABLE IF NOT EXISTS students (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             roll_number TEXT UNIQUE NOT NULL,
@@ -98,11 +244,9 @@ def init_database():
             parent_phone TEXT,
             is_active BOOLEAN DEFAULT 1,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create events table
-    cursor.execute('''
+        );
+        
+        -- Create events table
         CREATE TABLE IF NOT EXISTS events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -111,11 +255,9 @@ def init_database():
             event_type TEXT DEFAULT 'holiday',
             created_by TEXT,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create announcements table
-    cursor.execute('''
+        );
+        
+        -- Create announcements table
         CREATE TABLE IF NOT EXISTS announcements (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT NOT NULL,
@@ -125,7 +267,58 @@ def init_database():
             created_by TEXT,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             is_active BOOLEAN DEFAULT 1
-        )
+        );
+        
+        COMMIT;
+    ''')
+    
+    # Add the QR creation day to databases created before it existed
+    qr_columns = [row[1] for row in cursor.execute("PRAGMA table_xinfo(qr_codes)").fetchall()]
+    if 'created_day' not in qr_columns:
+        cursor.execute("ALTER TABLE qr_codes ADD COLUMN created_day DATE GENERATED ALWAYS AS (DATE(created_at)) VIRTUAL")
+    
+    # One-time data migrations, tracked in the database's user_version
+    schema_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if schema_version < 1:
+        # Older rows took created_date from SQLite's UTC DATE('now'); align it with the local timestamp
+        conn.executescript('''
+            BEGIN;
+            UPDATE attendance SET created_date = DATE(timestamp) WHERE created_date IS NOT DATE(timestamp);
+            PRAGMA user_version = 1;
+            COMMIT;
+        ''')
+    
+    if schema_version < 2:
+        # One attendance mark per student, class and day. Older databases deduplicated on the
+        # student's name, so keep the first mark per roll number and move repeats to
+        # attendance_duplicates for an admin to review before the unique index goes on
+        conn.executescript('''
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS attendance_duplicates AS SELECT * FROM attendance WHERE 0;
+            CREATE TEMP TABLE attendance_repeats AS
+                SELECT id FROM attendance
+                WHERE student_roll IS NOT NULL AND id NOT IN (
+                    SELECT MIN(id) FROM attendance
+                    WHERE student_roll IS NOT NULL
+                    GROUP BY student_roll, subject, period, created_date
+                );
+            INSERT INTO attendance_duplicates SELECT * FROM attendance WHERE id IN (SELECT id FROM attendance_repeats);
+            DELETE FROM attendance WHERE id IN (SELECT id FROM attendance_repeats);
+            DROP TABLE attendance_repeats;
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_att_unique ON attendance(student_roll, subject, period, created_date);
+            PRAGMA user_version = 2;
+            COMMIT;
+        ''')
+    
+    # Build the dashboard filter indexes
+    conn.executescript('''
+        BEGIN;
+        CREATE INDEX IF NOT EXISTS idx_att_date_ts ON attendance(created_date, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_att_ts ON attendance(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_att_marked_by_ts ON attendance(marked_by, timestamp DESC);
+        CREATE INDEX IF NOT EXISTS idx_att_subject_period_ts ON attendance(subject, period, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_qr_day ON qr_codes(created_day, created_by);
+        COMMIT;
     ''')
     
     # Check if default data exists
@@ -134,14 +327,9 @@ def init_database():
     
     if not admin_exists:
         # Create default admin (password: admin123)
-        admin_password_hash = hashlib.sha256("admin123".encode()).hexdigest()
-        cursor.execute('''
-            INSERT INTO faculty (faculty_id, name, email, department, password_hash, role)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', ('ADMIN001', 'Principal Administrator', 'admin@school.edu', 'Administration', admin_password_hash, 'admin'))
+        admin_password_hash = hash_password("admin123")
         
         # Create sample faculty members (password: pass123)
-        faculty_password_hash = hashlib.sha256("pass123".encode()).hexdigest()
         sample_faculty = [
             ('FAC001', 'Dr. Smith Johnson', 'smith@school.edu', 'Mathematics', 'Mathematics,Algebra,Geometry'),
             ('FAC002', 'Prof. Emily Davis', 'emily@school.edu', 'Science', 'Physics,Chemistry,Biology'),
@@ -149,12 +337,7 @@ def init_database():
             ('FAC004', 'Ms. Sarah Brown', 'sarah@school.edu', 'History', 'World History,Social Studies'),
             ('FAC005', 'Dr. Michael Lee', 'michael@school.edu', 'Computer Science', 'Programming,Database,Web Development')
         ]
-        
-        for faculty in sample_faculty:
-            cursor.execute('''
-                INSERT INTO faculty (faculty_id, name, email, department, subjects, password_hash)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (*faculty, faculty_password_hash))
+        faculty_rows = [(*faculty, hash_password("pass123")) for faculty in sample_faculty]
         
         # Create sample students
         sample_students = [
@@ -165,43 +348,125 @@ def init_database():
             ('2024005', 'Charlie Brown', '11-B', 'Arts', 'charlie@student.edu', '9876543218', '9876543219')
         ]
         
-        for student in sample_students:
+        # Insert all default data in a single transaction
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
             cursor.execute('''
+                INSERT INTO faculty (faculty_id, name, email, department, password_hash, role)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ('ADMIN001', 'Principal Administrator', 'admin@school.edu', 'Administration', admin_password_hash, 'admin'))
+            cursor.executemany('''
+                INSERT INTO faculty (faculty_id, name, email, department, subjects, password_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', faculty_rows)
+            cursor.executemany('''
                 INSERT INTO students (roll_number, name, class_grade, department, email, phone, parent_phone)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', student)
+            ''', sample_students)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     
-    conn.commit()
-    conn.close()
+    return True
 
 def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password using salted scrypt"""
+    salt = os.urandom(SALT_BYTES)
+    derived_key = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return PASSWORD_SCHEME + base64.b64encode(salt + derived_key).decode()
 
 def verify_password(password, hashed):
-    """Verify password against hash"""
-    return hashlib.sha256(password.encode()).hexdigest() == hashed
+    """Verify password against hash (accepts legacy unsalted SHA256 hashes)"""
+    if not hashed.startswith(PASSWORD_SCHEME):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+    
+    raw = base64.b64decode(hashed[len(PASSWORD_SCHEME):])
+    salt, derived_key = raw[:SALT_BYTES], raw[SALT_BYTES:]
+    return hmac.compare_digest(derived_key, hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS))
+
+def needs_rehash(hashed):
+    """Check whether a stored hash predates the scrypt scheme"""
+    return not hashed.startswith(PASSWORD_SCHEME)
+
+def record_login(conn, faculty_id, password, rehash):
+    """Write last login (and upgrade a legacy hash) on a background thread"""
+    login_time = datetime.now().isoformat()
+    
+    def write():
+        if rehash:
+            conn.execute(SQL_UPDATE_PASSWORD, (hash_password(password), faculty_id))
+        conn.execute(SQL_UPDATE_LOGIN, (login_time, faculty_id))
+    
+    threading.Thread(target=write, daemon=True).start()
+
+def today_iso(days_ago=0):
+    """Local date as a YYYY-MM-DD string, the format stored in created_date"""
+    return (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """Calculate distance between two GPS coordinates"""
-    R = 6371000  # Earth's radius in meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
+    phi1 = lat1 * DEG_TO_RAD
+    phi2 = lat2 * DEG_TO_RAD
+    sin_half_phi = math.sin((lat2 - lat1) * DEG_TO_RAD * 0.5)
+    sin_half_lambda = math.sin((lon2 - lon1) * DEG_TO_RAD * 0.5)
+    
+    a = sin_half_phi * sin_half_phi + math.cos(phi1) * math.cos(phi2) * sin_half_lambda * sin_half_lambda
+    
+    return EARTH_DIAMETER_M * math.asin(math.sqrt(a))
+
+def calculate_distance_vec(lat1, lon1, lat2, lon2):
+    """Calculate distances between arrays of GPS coordinates (broadcasts like NumPy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    delta_phi = lat2 - lat1
+    delta_lambda = lon2 - lon1
     
-    a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    a = np.sin(delta_phi * 0.5)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(delta_lambda * 0.5)**2
     
-    return R * c
+    return EARTH_DIAMETER_M * np.arcsin(np.sqrt(a))
+
+def encode_qr_payload(qr_data):
+    """Pack QR data into a compact base32 string (fits QR alphanumeric mode)"""
+    header = struct.pack(
+        QR_PAYLOAD_FORMAT,
+        uuid.UUID(qr_data['qr_id']).bytes,
+        int(datetime.fromisoformat(qr_data['created_at']).timestamp()),
+        int(datetime.fromisoformat(qr_data['expires_at']).timestamp()),
+        float(qr_data['latitude']),
+        float(qr_data['longitude'])
+    )
+    payload = header + f"{qr_data['subject']}|{qr_data['period']}".encode()
+    # Base32 padding '=' is not in the alphanumeric set, so strip it
+    return base64.b32encode(payload).decode().rstrip('=')
+
+def decode_qr_payload(text):
+    """Unpack a string produced by encode_qr_payload back into QR data"""
+    raw = base64.b32decode(text + '=' * (-len(text) % 8))
+    qr_id, created_at, expires_at, latitude, longitude = struct.unpack_from(QR_PAYLOAD_FORMAT, raw)
+    subject, period = raw[QR_PAYLOAD_HEADER_SIZE:].decode().rsplit('|', 1)
+    return {
+        "qr_id": str(uuid.UUID(bytes=qr_id)),
+        "subject": subject,
+        "period": period,
+        "latitude": latitude,
+        "longitude": longitude,
+        "created_at": datetime.fromtimestamp(created_at).isoformat(),
+        "expires_at": datetime.fromtimestamp(expires_at).isoformat()
+    }
 
 def generate_qr_code(qr_data):
     """Generate QR code image"""
+    import qrcode
+    
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(json.dumps(qr_data))
+    qr.add_data(encode_qr_payload(qr_data))
     qr.make(fit=True)
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    # Build a 1-bit image straight from the module matrix (dark modules are 0 bits)
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    size = modules.shape[0]
+    img = Image.frombytes('1', (size, size), np.packbits(~modules, axis=1).tobytes())
+    img = img.resize((size * qr.box_size, size * qr.box_size), Image.NEAREST)
     
     # Convert PIL image to bytes for Streamlit
     img_buffer = io.BytesIO()
@@ -210,28 +475,186 @@ def generate_qr_code(qr_data):
     
     return img, img_buffer.getvalue()
 
+@st.cache_resource
+def get_qr_detector():
+    """Get the shared OpenCV QR code detector"""
+    import cv2
+    
+    return cv2.QRCodeDetector()
+
 def read_qr_code(image):
     """Read QR code from uploaded image"""
+    import cv2
+    
     try:
-        # Convert PIL image to OpenCV format
-        opencv_img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        # The detector works on grayscale, so skip the 3-channel BGR copy
+        if isinstance(image, np.ndarray):
+            gray_img = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        else:
+            gray_img = np.asarray(image.convert('L'))
+        
+        # Detection cost grows with pixel count, so shrink large phone photos first
+        height, width = gray_img.shape[:2]
+        scale = QR_SCAN_MAX_SIDE / max(height, width)
+        if scale < 1:
+            gray_img = cv2.resize(gray_img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
         
-        # Initialize QR code detector
-        detector = cv2.QRCodeDetector()
+        # Reuse the shared QR code detector
+        detector = get_qr_detector()
         
         # Detect and decode QR code
-        data, vertices_array, binary_qrcode = detector.detectAndDecode(opencv_img)
+        data, vertices_array, binary_qrcode = detector.detectAndDecode(gray_img)
+        
+        # Retry low-contrast photos after local histogram equalization
+        if not data:
+            equalized_img = cv2.createCLAHE(clipLimit=2.0).apply(gray_img)
+            data, vertices_array, binary_qrcode = detector.detectAndDecode(equalized_img)
         
         if vertices_array is not None and len(data) > 0:
             try:
-                return json.loads(data)
-            except json.JSONDecodeError:
+                # QR codes printed before the compact payload carry JSON
+                if data.startswith('{'):
+                    return json.loads(data)
+                return decode_qr_payload(data)
+            except (json.JSONDecodeError, binascii.Error, struct.error, ValueError):
                 return None
         return None
     except Exception as e:
         st.error(f"Error reading QR code: {str(e)}")
         return None
 
+# CACHED DASHBOARD QUERIES
+@st.cache_data(ttl=60)
+def _today_counts(date_iso):
+    """Today's attendance, active students and active faculty in one query"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM attendance WHERE created_date = ?),
+            (SELECT COUNT(*) FROM students WHERE is_active = 1),
+            (SELECT COUNT(*) FROM faculty WHERE is_active = 1 AND role != 'admin')
+    ''', (date_iso,))
+    return cursor.fetchone()
+
+@st.cache_data(ttl=60)
+def _overview_counts(date_iso):
+    """Admin overview metrics (attendance, students, faculty, QR codes) in one query"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM attendance WHERE created_date = ?),
+            (SELECT COUNT(*) FROM students WHERE is_active = 1),
+            (SELECT COUNT(*) FROM faculty WHERE is_active = 1 AND role != 'admin'),
+            (SELECT COUNT(*) FROM qr_codes WHERE created_day = ?)
+    ''', (date_iso, date_iso))
+    return cursor.fetchone()
+
+@st.cache_data(ttl=60)
+def _faculty_today_counts(date_iso, faculty_id):
+    """QR codes generated and attendance marked today by a faculty member"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM qr_codes WHERE created_day = ? AND created_by = ?),
+            (SELECT COUNT(*) FROM attendance WHERE created_date = ? AND marked_by = ?)
+    ''', (date_iso, faculty_id, date_iso, faculty_id))
+    return cursor.fetchone()
+
+@st.cache_data(ttl=30)
+def _weekly_trend(since_iso):
+    """Daily attendance counts since a date"""
+    return fetch_dataframe('''
+        SELECT created_date as date, COUNT(*) as attendance
+        FROM attendance 
+        WHERE created_date >= ?
+        GROUP BY created_date
+        ORDER BY date
+    ''', (since_iso,))
+
+@st.cache_data(ttl=30)
+def _subject_distribution(since_iso):
+    """Per-subject attendance counts since a date"""
+    return fetch_dataframe('''
+        SELECT subject, COUNT(*) as count
+        FROM attendance 
+        WHERE created_date >= ?
+        GROUP BY subject
+        ORDER BY count DESC
+    ''', (since_iso,))
+
+@st.cache_data(ttl=5)
+def _attendance_version():
+    """Cheap change token for the attendance table (its highest row id)"""
+    return get_db_connection().execute("SELECT COALESCE(MAX(id), 0) FROM attendance").fetchone()[0]
+
+@st.cache_data(ttl=60)
+def _distinct_attendance_values(column, version):
+    """Sorted distinct subjects or periods; version ties the cache to new rows"""
+    if column not in ('subject', 'period'):
+        raise ValueError(f"Unsupported filter column: {column}")
+    rows = get_db_connection().execute(f"SELECT DISTINCT {column} FROM attendance ORDER BY {column}").fetchall()
+    return [row[0] for row in rows]
+
+@st.cache_data(ttl=300)
+def _attendance_counts(column, start_iso, end_iso, version):
+    """Attendance counts per value of a column in a date range, shaped like value_counts()"""
+    if column not in ('subject', 'status', 'period', 'created_date'):
+        raise ValueError(f"Unsupported grouping column: {column}")
+    rows = get_db_connection().execute(f'''
+        SELECT {column}, COUNT(*) as count
+        FROM attendance 
+        WHERE created_date BETWEEN ? AND ?
+        GROUP BY {column}
+        ORDER BY count DESC
+    ''', (start_iso, end_iso)).fetchall()
+    return pd.Series([row[1] for row in rows], index=[row[0] for row in rows], dtype='int64')
+
+@st.cache_data(ttl=300)
+def _counts_figure(kind, counts, x_title=None, y_title=None):
+    """Plotly pie/bar/line figure for a tuple of (label, count) pairs"""
+    import plotly.express as px
+    
+    labels = [label for label, _ in counts]
+    values = [count for _, count in counts]
+    if kind == 'pie':
+        return px.pie(values=values, names=labels)
+    
+    fig = px.bar(x=labels, y=values) if kind == 'bar' else px.line(x=labels, y=values)
+    fig.update_layout(xaxis_title=x_title, yaxis_title=y_title)
+    return fig
+
+@st.cache_data(ttl=60)
+def _recent_attendance(faculty_id):
+    """Last ten attendance records marked by a faculty member"""
+    return fetch_dataframe('''
+        SELECT student_name, subject, period, timestamp, status
+        FROM attendance 
+        WHERE marked_by = ? 
+        ORDER BY timestamp DESC LIMIT 10
+    ''', (faculty_id,))
+
+@st.cache_data(ttl=60)
+def _faculty_list():
+    """Non-admin faculty roster"""
+    return fetch_dataframe('''
+        SELECT faculty_id, name, department, subjects, is_active, last_login
+        FROM faculty 
+        WHERE role != 'admin'
+        ORDER BY name
+    ''')
+
+@st.cache_data(ttl=60)
+def _recent_announcements():
+    """Ten most recent announcements"""
+    return fetch_dataframe('''
+        SELECT title, target_audience, priority, created_at, is_active
+        FROM announcements 
+        ORDER BY created_at DESC LIMIT 10
+    ''')
+
 # HOME PAGE
 def home_page():
     """Main home page"""
@@ -274,23 +697,9 @@ def home_page():
     st.markdown("---")
     st.subheader("📈 Today's Quick Stats")
     
-    conn = get_db_connection()
     try:
-        today = datetime.now().date()
-        total_attendance_today = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM attendance WHERE DATE(timestamp) = ?", 
-            conn, params=[today]
-        ).iloc[0]['count']
-        
-        total_students = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM students WHERE is_active = 1", 
-            conn
-        ).iloc[0]['count']
-        
-        total_faculty = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM faculty WHERE is_active = 1 AND role != 'admin'", 
-            conn
-        ).iloc[0]['count']
+        today = today_iso()
+        total_attendance_today, total_students, total_faculty = _today_counts(today)
         
         col1, col2, col3, col4 = st.columns(4)
         with col1:
@@ -305,8 +714,6 @@ def home_page():
             
     except Exception as e:
         st.info("📊 No attendance data available yet. Start by logging in as faculty!")
-    finally:
-        conn.close()
 
 # FACULTY LOGIN PAGE
 def faculty_login():
@@ -339,21 +746,14 @@ def faculty_login():
                 cursor = conn.cursor()
                 
                 try:
-                    cursor.execute('''
-                        SELECT faculty_id, name, role, department, password_hash, is_active
-                        FROM faculty 
-                        WHERE faculty_id = ?
-                    ''', (faculty_id.upper(),))
+                    cursor.execute(SQL_LOGIN, (faculty_id.upper(),))
                     
                     faculty = cursor.fetchone()
                     
                     if faculty and faculty[5]:  # Check if active
                         if verify_password(password, faculty[4]):  # Verify password
-                            # Update last login
-                            cursor.execute('''
-                                UPDATE faculty SET last_login = ? WHERE faculty_id = ?
-                            ''', (datetime.now().isoformat(), faculty_id.upper()))
-                            conn.commit()
+                            # Update last login, upgrading legacy SHA256 hashes now that we have the plaintext
+                            record_login(conn, faculty[0], password, needs_rehash(faculty[4]))
                             
                             # Set session state
                             st.session_state.faculty_logged_in = True
@@ -378,8 +778,6 @@ def faculty_login():
                         
                 except Exception as e:
                     st.error(f"❌ Login error: {str(e)}")
-                finally:
-                    conn.close()
         
         # Demo credentials info
         with st.expander("🆘 Demo Credentials"):
@@ -436,38 +834,24 @@ def faculty_dashboard():
     st.markdown("---")
     
     # Today's summary
-    today = datetime.now().date()
-    conn = get_db_connection()
+    today = today_iso()
     
     try:
         # Get today's stats
-        qr_today = pd.read_sql_query('''
-            SELECT COUNT(*) as count FROM qr_codes 
-            WHERE DATE(created_at) = ? AND created_by = ?
-        ''', conn, params=[today, st.session_state.faculty_id])
-        
-        attendance_today = pd.read_sql_query('''
-            SELECT COUNT(*) as count FROM attendance 
-            WHERE DATE(timestamp) = ? AND marked_by = ?
-        ''', conn, params=[today, st.session_state.faculty_id])
+        qr_today, attendance_today = _faculty_today_counts(today, st.session_state.faculty_id)
         
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("QR Codes Generated Today", qr_today.iloc[0]['count'])
+            st.metric("QR Codes Generated Today", qr_today)
         with col2:
-            st.metric("Students Attended Today", attendance_today.iloc[0]['count'])
+            st.metric("Students Attended Today", attendance_today)
         with col3:
-            avg_attendance = "85%" if attendance_today.iloc[0]['count'] > 0 else "0%"
+            avg_attendance = "85%" if attendance_today > 0 else "0%"
             st.metric("Average Class Attendance", avg_attendance)
         
         # Recent activity
         st.subheader("📋 Recent Activity")
-        recent_attendance = pd.read_sql_query('''
-            SELECT student_name, subject, period, timestamp, status
-            FROM attendance 
-            WHERE marked_by = ? 
-            ORDER BY timestamp DESC LIMIT 10
-        ''', conn, params=[st.session_state.faculty_id])
+        recent_attendance = _recent_attendance(st.session_state.faculty_id)
         
         if not recent_attendance.empty:
             st.dataframe(recent_attendance, use_container_width=True)
@@ -476,8 +860,6 @@ def faculty_dashboard():
             
     except Exception as e:
         st.error(f"Error loading dashboard data: {str(e)}")
-    finally:
-        conn.close()
 
 # ADMIN DASHBOARD
 def admin_dashboard():
@@ -510,13 +892,11 @@ def admin_dashboard():
         
         # Show recent QR codes
         st.subheader("Recent QR Codes")
-        conn = get_db_connection()
-        qr_df = pd.read_sql_query('''
+        qr_df = fetch_dataframe('''
             SELECT subject, period, created_by, created_at, expires_at, is_active
             FROM qr_codes 
             ORDER BY created_at DESC LIMIT 10
-        ''', conn)
-        conn.close()
+        ''')
         
         if not qr_df.empty:
             st.dataframe(qr_df, use_container_width=True)
@@ -532,15 +912,13 @@ def admin_dashboard():
         
         # Today's attendance summary
         st.subheader("Today's Attendance Summary")
-        conn = get_db_connection()
-        today_attendance = pd.read_sql_query('''
+        today_attendance = fetch_dataframe('''
             SELECT subject, period, COUNT(*) as student_count
             FROM attendance 
-            WHERE DATE(timestamp) = DATE('now')
+            WHERE created_date = ?
             GROUP BY subject, period
             ORDER BY student_count DESC
-        ''', conn)
-        conn.close()
+        ''', (today_iso(),))
         
         if not today_attendance.empty:
             st.dataframe(today_attendance, use_container_width=True)
@@ -555,32 +933,17 @@ def admin_dashboard():
 
 def admin_overview():
     """Admin overview with stats and charts"""
-    st.subheader("📈 School Statistics Overview")
+    import plotly.express as px
     
-    conn = get_db_connection()
+    st.subheader("📈 School Statistics Overview")
     
     # Get key metrics
     try:
-        today = datetime.now().date()
+        today = today_iso()
+        week_start = today_iso(days_ago=7)
         
         # Today's metrics
-        today_attendance = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM attendance WHERE DATE(timestamp) = ?", 
-            conn, params=[today]
-        ).iloc[0]['count']
-        
-        total_students = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM students WHERE is_active = 1", conn
-        ).iloc[0]['count']
-        
-        total_faculty = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM faculty WHERE is_active = 1 AND role != 'admin'", conn
-        ).iloc[0]['count']
-        
-        total_qr_codes = pd.read_sql_query(
-            "SELECT COUNT(*) as count FROM qr_codes WHERE DATE(created_at) = ?", 
-            conn, params=[today]
-        ).iloc[0]['count']
+        today_attendance, total_students, total_faculty, total_qr_codes = _overview_counts(today)
         
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -598,13 +961,7 @@ def admin_overview():
         
         with col1:
             # Weekly attendance trend
-            weekly_data = pd.read_sql_query('''
-                SELECT DATE(timestamp) as date, COUNT(*) as attendance
-                FROM attendance 
-                WHERE timestamp >= date('now', '-7 days')
-                GROUP BY DATE(timestamp)
-                ORDER BY date
-            ''', conn)
+            weekly_data = _weekly_trend(week_start)
             
             if not weekly_data.empty:
                 fig = px.line(weekly_data, x='date', y='attendance', 
@@ -615,13 +972,7 @@ def admin_overview():
         
         with col2:
             # Subject-wise distribution
-            subject_data = pd.read_sql_query('''
-                SELECT subject, COUNT(*) as count
-                FROM attendance 
-                WHERE timestamp >= date('now', '-7 days')
-                GROUP BY subject
-                ORDER BY count DESC
-            ''', conn)
+            subject_data = _subject_distribution(week_start)
             
             if not subject_data.empty:
                 fig = px.pie(subject_data, values='count', names='subject',
@@ -632,8 +983,6 @@ def admin_overview():
                 
     except Exception as e:
         st.error(f"Error loading overview data: {str(e)}")
-    finally:
-        conn.close()
 
 def user_management():
     """User management interface"""
@@ -664,26 +1013,18 @@ def user_management():
                             VALUES (?, ?, ?, ?, ?, ?)
                         ''', (new_faculty_id.upper(), new_name, new_email, new_department, new_subjects, password_hash))
                         conn.commit()
+                        _faculty_list.clear()
                         st.success(f"✅ Faculty {new_faculty_id} added successfully!")
                     except sqlite3.IntegrityError:
                         st.error("❌ Faculty ID already exists!")
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
-                    finally:
-                        conn.close()
                 else:
                     st.error("❌ Please fill in required fields!")
     
     # Show existing faculty
     st.subheader("📋 Current Faculty")
-    conn = get_db_connection()
-    faculty_df = pd.read_sql_query('''
-        SELECT faculty_id, name, department, subjects, is_active, last_login
-        FROM faculty 
-        WHERE role != 'admin'
-        ORDER BY name
-    ''', conn)
-    conn.close()
+    faculty_df = _faculty_list()
     
     if not faculty_df.empty:
         st.dataframe(faculty_df, use_container_width=True)
@@ -712,20 +1053,14 @@ def announcements_management():
                     VALUES (?, ?, ?, ?, ?)
                 ''', (title, message, target, priority, st.session_state.faculty_id))
                 conn.commit()
-                conn.close()
+                _recent_announcements.clear()
                 st.success("✅ Announcement created successfully!")
             else:
                 st.error("❌ Please fill in all fields!")
     
     # Show recent announcements
     st.subheader("📋 Recent Announcements")
-    conn = get_db_connection()
-    announcements_df = pd.read_sql_query('''
-        SELECT title, target_audience, priority, created_at, is_active
-        FROM announcements 
-        ORDER BY created_at DESC LIMIT 10
-    ''', conn)
-    conn.close()
+    announcements_df = _recent_announcements()
     
     if not announcements_df.empty:
         st.dataframe(announcements_df, use_container_width=True)
@@ -780,7 +1115,8 @@ def generate_qr_page():
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (qr_id, subject, period, latitude, longitude, created_at.isoformat(), expires_at.isoformat(), st.session_state.faculty_id))
             conn.commit()
-            conn.close()
+            _faculty_today_counts.clear()
+            _overview_counts.clear()
             
             # Generate QR code image
             qr_img, qr_img_bytes = generate_qr_code(qr_data)
@@ -816,25 +1152,19 @@ def view_attendance():
     
     conn = get_db_connection()
     
-    # Get all attendance records
-    df = pd.read_sql_query('''
-        SELECT id, student_name, student_roll, subject, period, 
-               timestamp, status, marked_by, student_latitude, student_longitude
-        FROM attendance 
-        ORDER BY timestamp DESC
-    ''', conn)
-    conn.close()
+    # Only check whether any records exist instead of loading the whole table
+    version = _attendance_version()
     
-    if not df.empty:
+    if version:
         st.subheader("🔍 Filter Records")
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            subjects = ["All"] + sorted(df['subject'].unique().tolist())
+            subjects = ["All"] + _distinct_attendance_values('subject', version)
             selected_subject = st.selectbox("Filter by Subject", subjects)
         
         with col2:
-            periods = ["All"] + sorted(df['period'].unique().tolist())
+            periods = ["All"] + _distinct_attendance_values('period', version)
             selected_period = st.selectbox("Filter by Period", periods)
         
         with col3:
@@ -843,36 +1173,88 @@ def view_attendance():
         with col4:
             status_filter = st.selectbox("Filter by Status", ["All", "present", "absent", "late"])
         
-        # Apply filters
-        filtered_df = df.copy()
+        # Apply filters in SQL
+        conditions = []
+        params = []
         
         if selected_subject != "All":
-            filtered_df = filtered_df[filtered_df['subject'] == selected_subject]
+            conditions.append("subject = ?")
+            params.append(selected_subject)
         
         if selected_period != "All":
-            filtered_df = filtered_df[filtered_df['period'] == selected_period]
+            conditions.append("period = ?")
+            params.append(selected_period)
         
         if date_filter:
-            filtered_df['date'] = pd.to_datetime(filtered_df['timestamp'], format='mixed').dt.date
-            filtered_df = filtered_df[filtered_df['date'] == date_filter]
+            conditions.append("created_date = ?")
+            params.append(date_filter.isoformat())
         
         if status_filter != "All":
-            filtered_df = filtered_df[filtered_df['status'] == status_filter]
+            conditions.append("status = ?")
+            params.append(status_filter)
+        
+        where_clause = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        total_records = conn.execute(f"SELECT COUNT(*) FROM attendance{where_clause}", params).fetchone()[0]
+        
+        # Keyset pagination - attendance_cursors holds the (timestamp, id) each visited page
+        # started after, so Previous pops the stack; start over whenever the filters change
+        filter_key = (selected_subject, selected_period, str(date_filter), status_filter)
+        if st.session_state.get('attendance_filter_key') != filter_key:
+            st.session_state.attendance_filter_key = filter_key
+            st.session_state.attendance_cursors = []
+        cursors = st.session_state.attendance_cursors
+        
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if cursors:
+            page_conditions.append("(timestamp, id) < (?, ?)")
+            page_params.extend(cursors[-1])
+        
+        page_where = (" WHERE " + " AND ".join(page_conditions)) if page_conditions else ""
+        page_df = fetch_dataframe(f'''
+            SELECT id, student_name, student_roll, subject, period, timestamp, status, marked_by
+            FROM attendance{page_where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', page_params + [ATTENDANCE_PAGE_SIZE])
         
         # Display results
-        st.subheader(f"📊 Found {len(filtered_df)} Records")
+        st.subheader(f"📊 Found {total_records} Records")
         
-        if not filtered_df.empty:
+        if not page_df.empty:
             # Display dataframe
-            display_df = filtered_df[['student_name', 'student_roll', 'subject', 'period', 'timestamp', 'status', 'marked_by']]
+            display_df = page_df[['student_name', 'student_roll', 'subject', 'period', 'timestamp', 'status', 'marked_by']]
             st.dataframe(display_df, use_container_width=True)
             
+            # Page navigation
+            first_row = len(cursors) * ATTENDANCE_PAGE_SIZE + 1
+            st.caption(f"Showing records {first_row}-{first_row + len(page_df) - 1} of {total_records}")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if cursors and st.button("⏮️ First Page"):
+                    cursors.clear()
+                    st.rerun()
+            with col2:
+                if cursors and st.button("⬅️ Previous Page"):
+                    cursors.pop()
+                    st.rerun()
+            with col3:
+                if first_row + len(page_df) - 1 < total_records and st.button("Next Page ➡️"):
+                    last_row = page_df.iloc[-1]
+                    cursors.append((last_row['timestamp'], int(last_row['id'])))
+                    st.rerun()
+            
             # Export button
             if st.button("📥 Export to CSV"):
-                csv = display_df.to_csv(index=False)
+                csv_data = export_csv(f'''
+                    SELECT student_name, student_roll, subject, period, timestamp, status, marked_by
+                    FROM attendance{where_clause}
+                    ORDER BY timestamp DESC, id DESC
+                ''', params)
                 st.download_button(
                     label="💾 Download CSV File",
-                    data=csv,
+                    data=csv_data,
                     file_name=f"attendance_records_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                     mime="text/csv"
                 )
@@ -882,6 +1264,15 @@ def view_attendance():
         st.info("📊 No attendance records found. Generate QR codes and have students scan them!")
 
 # EDIT ATTENDANCE PAGE
+def _select_edit_record():
+    """Remember the id of the row picked in the edit table (row positions shift as records arrive)"""
+    selected_rows = st.session_state.edit_record_table.selection.rows
+    if selected_rows:
+        # Callbacks run before the rerun, so edit_record_ids still lists the rows the user saw
+        st.session_state.edit_record_id = st.session_state.edit_record_ids[selected_rows[0]]
+    elif 'edit_record_id' in st.session_state:
+        del st.session_state.edit_record_id
+
 def edit_attendance():
     """Edit attendance records"""
     st.title("✏️ Edit Attendance Records")
@@ -908,7 +1299,7 @@ def edit_attendance():
     # Get records based on search
     query = '''
         SELECT id, student_name, student_roll, subject, period, 
-               DATE(timestamp) as date, status, marked_by, timestamp
+               created_date as date, status, marked_by, timestamp
         FROM attendance 
         WHERE 1=1
     '''
@@ -923,34 +1314,37 @@ def edit_attendance():
         params.append(f"%{search_subject}%")
     
     if search_date:
-        query += " AND DATE(timestamp) = ?"
+        query += " AND created_date = ?"
         params.append(search_date.strftime('%Y-%m-%d'))
     
     query += " ORDER BY timestamp DESC LIMIT 50"
     
-    df = pd.read_sql_query(query, conn, params=params)
+    df = fetch_dataframe(query, params)
     
     if not df.empty:
         st.subheader("📋 Select Record to Edit")
         
-        # Display records for selection
-        for idx, row in df.iterrows():
-            col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
-            
-            with col1:
-                st.write(f"**{row['student_name']}** ({row['student_roll']})")
-            with col2:
-                st.write(f"{row['subject']} - {row['period']}")
-            with col3:
-                st.write(f"{row['date']} - Status: **{row['status']}**")
-            with col4:
-                if st.button("✏️ Edit", key=f"edit_{row['id']}"):
-                    st.session_state.edit_record_id = row['id']
+        # Display records for selection (a single widget instead of an Edit button per row)
+        st.caption("Click a row to edit it.")
+        st.session_state.edit_record_ids = df['id'].astype(int).tolist()
+        st.dataframe(
+            df[['student_name', 'student_roll', 'subject', 'period', 'date', 'status']],
+            use_container_width=True,
+            hide_index=True,
+            on_select=_select_edit_record,
+            selection_mode="single-row",
+            key="edit_record_table"
+        )
+        
+        # Edit form - look the record up by id, not by its position in the table
+        record_id = st.session_state.get('edit_record_id')
+        record_df = fetch_dataframe('''
+            SELECT id, student_name, student_roll, subject, period, created_date as date, status
+            FROM attendance WHERE id = ?
+        ''', (record_id,)) if record_id else None
         
-        # Edit form
-        if 'edit_record_id' in st.session_state:
-            record_id = st.session_state.edit_record_id
-            selected_record = df[df['id'] == record_id].iloc[0]
+        if record_df is not None and not record_df.empty:
+            selected_record = record_df.iloc[0]
             
             st.markdown("---")
             st.subheader(f"✏️ Editing Record for {selected_record['student_name']}")
@@ -987,24 +1381,25 @@ def edit_attendance():
                             WHERE id = ?
                         ''', (new_status, st.session_state.faculty_id, modification_reason, record_id))
                         conn.commit()
+                        _attendance_counts.clear()
                         
                         st.success(f"✅ Record updated! Status changed from '{selected_record['status']}' to '{new_status}'")
                         
                         # Clear the edit state
-                        if 'edit_record_id' in st.session_state:
-                            del st.session_state.edit_record_id
+                        for key in ('edit_record_id', 'edit_record_table'):
+                            if key in st.session_state:
+                                del st.session_state[key]
                         st.rerun()
                 
                 with col2:
                     if st.form_submit_button("❌ Cancel"):
-                        if 'edit_record_id' in st.session_state:
-                            del st.session_state.edit_record_id
+                        for key in ('edit_record_id', 'edit_record_table'):
+                            if key in st.session_state:
+                                del st.session_state[key]
                         st.rerun()
     
     else:
         st.info("🔍 No records found. Try adjusting your search criteria.")
-    
-    conn.close()
 
 # ANALYTICS PAGE
 def analytics():
@@ -1017,15 +1412,9 @@ def analytics():
         st.session_state.page = back_page
         st.rerun()
     
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM attendance", conn)
-    conn.close()
+    version = _attendance_version()
     
-    if not df.empty:
-        # Convert timestamp to proper format
-        df['date'] = pd.to_datetime(df['timestamp'], format='mixed').dt.date
-        df['datetime'] = pd.to_datetime(df['timestamp'], format='mixed')
-        
+    if version:
         # Time range selector
         col1, col2 = st.columns(2)
         with col1:
@@ -1033,24 +1422,26 @@ def analytics():
         with col2:
             end_date = st.date_input("To Date", value=datetime.now().date())
         
-        # Filter by date range
-        filtered_df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+        # Aggregate the date range in SQL
+        start_iso, end_iso = start_date.isoformat(), end_date.isoformat()
+        status_counts = _attendance_counts('status', start_iso, end_iso, version)
+        total_records = int(status_counts.sum())
         
-        if not filtered_df.empty:
+        if total_records > 0:
             st.markdown("---")
             
             # Key metrics
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("Total Records", len(filtered_df))
+                st.metric("Total Records", total_records)
             with col2:
-                present_count = len(filtered_df[filtered_df['status'] == 'present'])
+                present_count = int(status_counts.get('present', 0))
                 st.metric("Present", present_count)
             with col3:
-                absent_count = len(filtered_df[filtered_df['status'] == 'absent'])
+                absent_count = int(status_counts.get('absent', 0))
                 st.metric("Absent", absent_count)
             with col4:
-                attendance_rate = f"{(present_count/len(filtered_df)*100):.1f}%" if len(filtered_df) > 0 else "0%"
+                attendance_rate = f"{(present_count/total_records*100):.1f}%"
                 st.metric("Attendance Rate", attendance_rate)
             
             # Charts
@@ -1058,33 +1449,29 @@ def analytics():
             
             with col1:
                 st.subheader("📊 Subject-wise Distribution")
-                subject_counts = filtered_df['subject'].value_counts()
+                subject_counts = _attendance_counts('subject', start_iso, end_iso, version)
                 if not subject_counts.empty:
-                    fig_pie = px.pie(values=subject_counts.values, names=subject_counts.index)
+                    fig_pie = _counts_figure('pie', tuple(subject_counts.items()))
                     st.plotly_chart(fig_pie, use_container_width=True)
             
             with col2:
                 st.subheader("📊 Status Distribution")
-                status_counts = filtered_df['status'].value_counts()
                 if not status_counts.empty:
-                    fig_bar = px.bar(x=status_counts.index, y=status_counts.values)
-                    fig_bar.update_layout(xaxis_title="Status", yaxis_title="Count")
+                    fig_bar = _counts_figure('bar', tuple(status_counts.items()), "Status", "Count")
                     st.plotly_chart(fig_bar, use_container_width=True)
             
             # Daily trend
             st.subheader("📈 Daily Attendance Trend")
-            daily_counts = filtered_df['date'].value_counts().sort_index()
+            daily_counts = _attendance_counts('created_date', start_iso, end_iso, version).sort_index()
             if not daily_counts.empty:
-                fig_line = px.line(x=daily_counts.index, y=daily_counts.values)
-                fig_line.update_layout(xaxis_title="Date", yaxis_title="Number of Students")
+                fig_line = _counts_figure('line', tuple(daily_counts.items()), "Date", "Number of Students")
                 st.plotly_chart(fig_line, use_container_width=True)
             
             # Period-wise analysis
             st.subheader("🕐 Period-wise Attendance")
-            period_counts = filtered_df['period'].value_counts()
+            period_counts = _attendance_counts('period', start_iso, end_iso, version)
             if not period_counts.empty:
-                fig_period = px.bar(x=period_counts.index, y=period_counts.values)
-                fig_period.update_layout(xaxis_title="Period", yaxis_title="Number of Students")
+                fig_period = _counts_figure('bar', tuple(period_counts.items()), "Period", "Number of Students")
                 st.plotly_chart(fig_period, use_container_width=True)
         
         else:
@@ -1143,9 +1530,7 @@ def student_app():
             cursor = conn.cursor()
             
             try:
-                cursor.execute('''
-                    SELECT * FROM qr_codes WHERE qr_id = ? AND is_active = 1
-                ''', (qr_data['qr_id'],))
+                cursor.execute(SQL_QR_LOOKUP, (qr_data['qr_id'],))
                 
                 qr_record = cursor.fetchone()
                 
@@ -1169,46 +1554,30 @@ def student_app():
                         submit_attendance = st.form_submit_button("✅ Mark My Attendance", type="primary")
                         
                         if submit_attendance and student_name.strip() and student_roll.strip():
-                            # Check for duplicate attendance
-                            today = datetime.now().date().isoformat()
-                            cursor.execute('''
-                                SELECT COUNT(*) FROM attendance 
-                                WHERE student_name = ? AND subject = ? AND period = ? 
-                                AND DATE(timestamp) = ?
-                            ''', (student_name.strip(), qr_data['subject'], qr_data['period'], today))
+                            # Check location distance
+                            distance = calculate_distance(
+                                float(qr_data['latitude']), float(qr_data['longitude']),
+                                student_lat, student_lon
+                            )
                             
-                            existing_count = cursor.fetchone()[0]
+                            st.info(f"📏 **Distance from classroom:** {distance:.2f} meters")
                             
-                            if existing_count > 0:
-                                st.warning("⚠️ You have already marked attendance for this subject today!")
-                            else:
-                                # Check location distance
-                                distance = calculate_distance(
-                                    float(qr_data['latitude']), float(qr_data['longitude']),
-                                    student_lat, student_lon
-                                )
+                            # Allow attendance if within reasonable distance (1km for testing)
+                            if distance <= 1000:  # 1000 meters = 1km
+                                device_id = str(uuid.uuid4())
+                                marked_at = datetime.now()
                                 
-                                st.info(f"📏 **Distance from classroom:** {distance:.2f} meters")
+                                # Save attendance record (batched with concurrent submissions)
+                                attendance_id = save_attendance((
+                                    student_name.strip(), student_roll.strip(), qr_data['subject'], qr_data['period'],
+                                    marked_at.isoformat(), device_id,
+                                    student_lat, student_lon, qr_data['latitude'], qr_data['longitude'], 
+                                    'present', 'student_app', marked_at.date().isoformat()
+                                ))
                                 
-                                # Allow attendance if within reasonable distance (1km for testing)
-                                if distance <= 1000:  # 1000 meters = 1km
-                                    device_id = str(uuid.uuid4())
-                                    
-                                    # Save attendance record
-                                    cursor.execute('''
-                                        INSERT INTO attendance (
-                                            student_name, student_roll, subject, period, timestamp, device_id,
-                                            student_latitude, student_longitude, qr_latitude, qr_longitude, 
-                                            status, marked_by
-                                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                    ''', (
-                                        student_name.strip(), student_roll.strip(), qr_data['subject'], qr_data['period'],
-                                        datetime.now().isoformat(), device_id,
-                                        student_lat, student_lon, qr_data['latitude'], qr_data['longitude'], 
-                                        'present', 'student_app'
-                                    ))
-                                    conn.commit()
-                                    
+                                if attendance_id is None:
+                                    st.warning("⚠️ You have already marked attendance for this subject today!")
+                                else:
                                     st.success("🎉 **Attendance marked successfully!**")
                                     st.balloons()
                                     
@@ -1218,20 +1587,20 @@ def student_app():
                                     - **Student:** {student_name} ({student_roll})
                                     - **Subject:** {qr_data['subject']}
                                     - **Period:** {qr_data['period']}
-                                    - **Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+                                    - **Time:** {marked_at.strftime('%Y-%m-%d %H:%M:%S')}
                                     - **Status:** Present
                                     """)
-                                    
-                                else:
-                                    st.error(f"""
-                                    ❌ **Location verification failed!**
-                                    
-                                    You are **{distance:.2f} meters** away from the classroom.
-                                    Maximum allowed distance is **1000 meters**.
-                                    
-                                    Please move closer to the classroom and try again.
-                                    """)
-                        
+                                
+                            else:
+                                st.error(f"""
+                                ❌ **Location verification failed!**
+                                
+                                You are **{distance:.2f} meters** away from the classroom.
+                                Maximum allowed distance is **1000 meters**.
+                                
+                                Please move closer to the classroom and try again.
+                                """)
+                    
                         elif submit_attendance:
                             st.error("❌ Please enter both your name and roll number!")
                 
@@ -1240,8 +1609,6 @@ def student_app():
                     
             except Exception as e:
                 st.error(f"❌ **Database error:** {str(e)}")
-            finally:
-                conn.close()
         
         else:
             st.error("""
@@ -1258,6 +1625,27 @@ def student_app():
                 with st.expander("🔍 Debug Information"):
                     st.json(qr_data)
 
+# Page routing table - page name -> (render function, required access)
+PAGES = {
+    'home': (home_page, None),
+    'faculty_login': (faculty_login, None),
+    'faculty_dashboard': (faculty_dashboard, 'faculty'),
+    'admin_dashboard': (admin_dashboard, 'admin'),
+    'generate_qr': (generate_qr_page, 'faculty'),
+    'view_attendance': (view_attendance, 'faculty'),
+    'edit_attendance': (edit_attendance, 'faculty'),
+    'analytics': (analytics, 'faculty'),
+    'student_app': (student_app, None)
+}
+
+def has_page_access(access):
+    """Check whether the current session may open a page with the given access level"""
+    if access is None:
+        return True
+    if not st.session_state.get('faculty_logged_in'):
+        return False
+    return access == 'faculty' or st.session_state.get('faculty_role') == 'admin'
+
 # MAIN APPLICATION
 def main():
     """Main application function"""
@@ -1277,59 +1665,14 @@ def main():
     if 'faculty_logged_in' not in st.session_state:
         st.session_state.faculty_logged_in = False
     
-    # Custom CSS for better styling
-    st.markdown("""
-    <style>
-    .main > div {
-        padding-top: 2rem;
-    }
-    .stButton > button {
-        border-radius: 10px;
-        border: none;
-        font-weight: bold;
-        transition: all 0.3s;
-    }
-    .stButton > button[kind="primary"] {
-        background: linear-gradient(45deg, #667eea 0%, #764ba2 100%);
-        color: white;
-    }
-    .stButton > button[kind="primary"]:hover {
-        background: linear-gradient(45deg, #764ba2 0%, #667eea 100%);
-        transform: translateY(-2px);
-    }
-    .stButton > button[kind="secondary"] {
-        background: linear-gradient(45deg, #ffeaa7 0%, #fab1a0 100%);
-        color: #2d3436;
-    }
-    .stMetric {
-        background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-        padding: 1rem;
-        border-radius: 10px;
-        color: white;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # Custom CSS for better styling (re-sent each run; Streamlit drops elements a rerun skips)
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     
     # Page routing
     try:
-        if st.session_state.page == 'home':
-            home_page()
-        elif st.session_state.page == 'faculty_login':
-            faculty_login()
-        elif st.session_state.page == 'faculty_dashboard' and st.session_state.get('faculty_logged_in'):
-            faculty_dashboard()
-        elif st.session_state.page == 'admin_dashboard' and st.session_state.get('faculty_logged_in') and st.session_state.get('faculty_role') == 'admin':
-            admin_dashboard()
-        elif st.session_state.page == 'generate_qr' and st.session_state.get('faculty_logged_in'):
-            generate_qr_page()
-        elif st.session_state.page == 'view_attendance' and st.session_state.get('faculty_logged_in'):
-            view_attendance()
-        elif st.session_state.page == 'edit_attendance' and st.session_state.get('faculty_logged_in'):
-            edit_attendance()
-        elif st.session_state.page == 'analytics' and st.session_state.get('faculty_logged_in'):
-            analytics()
-        elif st.session_state.page == 'student_app':
-            student_app()
+        page_fn, access = PAGES.get(st.session_state.page, (None, None))
+        if page_fn and has_page_access(access):
+            page_fn()
         else:
             # Redirect to home for invalid states
             st.session_state.page = 'home'